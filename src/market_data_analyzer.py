@@ -4,23 +4,98 @@ import json
 import sqlite3
 import numpy as np
 import pandas as pd
+import torch
+from numpy.lib.stride_tricks import sliding_window_view
 from datetime import datetime, timedelta
 import os
 import sys
 import time
+import select
 from typing import List, Dict, Tuple
 import signal
+from collections import deque
+
+try:
+    import talib
+except ImportError:  # TA-Lib is optional; fall back to pandas indicators
+    talib = None
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional; fall back to pandas ewm smoothing
+    njit = None
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the standard library
+    orjson = None
+
+
+def json_loads(data):
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def _finite_or_none(obj):
+    # orjson writes NaN/inf as null; do the same so the wire format does not
+    # depend on which serializer is installed
+    if isinstance(obj, float):
+        return obj if np.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {key: _finite_or_none(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_finite_or_none(value) for value in obj]
+    return obj
+
+
+def json_dumps(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(_finite_or_none(obj), allow_nan=False).encode()
+
+
+def _wilder(x: np.ndarray, n: int) -> np.ndarray:
+    """Wilder's smoothing: out[i] = (out[i-1] * (n - 1) + x[i]) / n"""
+    out = np.empty_like(x)
+    if len(x) == 0:
+        return out
+    out[0] = x[0]
+    for i in range(1, len(x)):
+        out[i] = (out[i - 1] * (n - 1) + x[i]) / n
+    return out
+
+
+if njit is not None:
+    _wilder = njit(cache=True, fastmath=True)(_wilder)
 
 # Import our neural network
 from stock_ranking_nn import StockRanker
 
 class MarketDataAnalyzer:
-    def __init__(self, db_path="trading_system.db", pipe_base="/tmp/trading_system_pipe"):
+    # Length of the vector built by prepare_features
+    FEATURES = 10
+    
+    INSERT_SIGNAL_QUERY = """
+    INSERT INTO trading_signals (symbol, confidence, action, suggested_position_size, timestamp)
+    VALUES (?, ?, ?, ?, ?)
+    """
+    
+    def __init__(self, db_path="trading_system.db", pipe_base="/tmp/trading_system_pipe", debug=False):
         self.db_path = db_path
+        self.debug = debug
         self.pipe_to_python = pipe_base + "_to_python"
         self.pipe_to_cpp = pipe_base + "_to_cpp"
         self.running = True
-        self.ranker = None
+        
+        # Build (and warm up) the ranker once; weights live in shared memory so
+        # forked workers reuse them instead of copying
+        self.ranker = StockRanker(input_features=self.FEATURES)
+        self.ranker.model.share_memory()
+        
+        # Signals keyed on (symbol, latest bar, ranker weights version) so repeat
+        # queries skip the pipeline until a new bar arrives or the ranker is retrained
+        self._sig_cache: Dict[Tuple[str, pd.Timestamp, int], Dict] = {}
+        self._sig_cache_order = deque()
+        self._sig_cache_size = 1024
         
         # Set up signal handler for graceful shutdown
         signal.signal(signal.SIGTERM, self.signal_handler)
@@ -32,9 +107,14 @@ class MarketDataAnalyzer:
         
     def connect_database(self):
         """Connect to SQLite database"""
-        self.conn = sqlite3.connect(self.db_path)
+        # Autocommit mode; writes open their own transaction with BEGIN IMMEDIATE
+        self.conn = sqlite3.connect(self.db_path, isolation_level=None)
         self.cursor = self.conn.cursor()
         
+        # WAL with NORMAL sync avoids an fsync on every commit
+        self.cursor.execute("PRAGMA journal_mode=WAL")
+        self.cursor.execute("PRAGMA synchronous=NORMAL")
+        
     def fetch_market_data(self, symbol: str, days: int = 30) -> pd.DataFrame:
         """Fetch market data from database"""
         end_date = datetime.now()
@@ -47,24 +127,83 @@ class MarketDataAnalyzer:
         ORDER BY timestamp DESC
         """
         
-        df = pd.read_sql_query(query, self.conn, 
-                              params=(symbol, start_date.strftime('%Y-%m-%d'), 
-                                     end_date.strftime('%Y-%m-%d')))
+        rows = self.cursor.execute(query, (symbol, start_date.strftime('%Y-%m-%d'),
+                                           end_date.strftime('%Y-%m-%d'))).fetchall()
         
-        if not df.empty:
-            df['timestamp'] = pd.to_datetime(df['timestamp'])
-            df.set_index('timestamp', inplace=True)
+        return self.market_data_frame(rows)
+    
+    def fetch_market_data_bulk(self, symbols: List[str], days: int = 30) -> pd.DataFrame:
+        """Fetch market data for several symbols with a single query"""
+        end_date = datetime.now()
+        start_date = end_date - timedelta(days=days)
         
-        return df
+        placeholders = ', '.join('?' * len(symbols))
+        query = f"""
+        SELECT symbol, open, high, low, close, volume, timestamp
+        FROM market_data
+        WHERE symbol IN ({placeholders}) AND timestamp >= ? AND timestamp <= ?
+        ORDER BY symbol, timestamp DESC
+        """
+        
+        rows = self.cursor.execute(query, (*symbols, start_date.strftime('%Y-%m-%d'),
+                                           end_date.strftime('%Y-%m-%d'))).fetchall()
+        
+        return self.market_data_frame(rows)
+    
+    def market_data_frame(self, rows: List[Tuple]) -> pd.DataFrame:
+        """Build a timestamp-indexed DataFrame from raw market_data rows"""
+        columns = ['symbol', 'open', 'high', 'low', 'close', 'volume', 'timestamp']
+        if not rows:
+            return pd.DataFrame(columns=columns[:-1])
+        
+        # Columns have known types, so convert them directly instead of letting
+        # pandas infer dtypes and parse timestamps row by row
+        symbol, open_, high, low, close, volume, timestamp = zip(*rows)
+        index = pd.DatetimeIndex(np.asarray(timestamp, dtype='datetime64[ns]'), name='timestamp')
+        
+        return pd.DataFrame({
+            'symbol': np.asarray(symbol, dtype=object),
+            'open': np.asarray(open_, dtype=np.float64),
+            'high': np.asarray(high, dtype=np.float64),
+            'low': np.asarray(low, dtype=np.float64),
+            'close': np.asarray(close, dtype=np.float64),
+            'volume': np.asarray(volume, dtype=np.float64),
+        }, index=index)
     
     def calculate_technical_indicators(self, df: pd.DataFrame) -> pd.DataFrame:
         """Calculate technical indicators for the data"""
         if df.empty:
             return df
         
-        # Simple Moving Averages
-        df['SMA_5'] = df['close'].rolling(window=5).mean()
-        df['SMA_20'] = df['close'].rolling(window=20).mean()
+        close = df['close'].to_numpy(dtype=np.float64)
+        
+        # TA-Lib is only used where it matches the numpy/pandas results exactly, so
+        # signals do not depend on whether it is installed. Its EMA, MACD and RSI seed
+        # from an SMA and leave longer NaN warm-ups, so those always use the shared code.
+        if talib is not None:
+            # Simple Moving Averages
+            df['SMA_5'] = talib.SMA(close, timeperiod=5)
+            df['SMA_20'] = talib.SMA(close, timeperiod=20)
+            
+            # Bollinger Bands; TA-Lib's STDDEV is the population std, rescale to ddof=1
+            bb_middle = df['SMA_20'].to_numpy()
+            bb_std = talib.STDDEV(close, timeperiod=20, nbdev=1) * np.sqrt(20 / 19)
+        else:
+            # Simple Moving Averages
+            df['SMA_5'] = df['close'].rolling(window=5).mean()
+            df['SMA_20'] = df['close'].rolling(window=20).mean()
+            
+            # Bollinger Bands
+            bb_middle = np.full(len(close), np.nan)
+            bb_std = np.full(len(close), np.nan)
+            if len(close) >= 20:
+                window = sliding_window_view(close, 20)
+                bb_middle[19:] = window.mean(axis=1)
+                bb_std[19:] = window.std(axis=1, ddof=1)
+        
+        df['BB_middle'] = bb_middle
+        df['BB_upper'] = bb_middle + (bb_std * 2)
+        df['BB_lower'] = bb_middle - (bb_std * 2)
         
         # Exponential Moving Averages
         df['EMA_12'] = df['close'].ewm(span=12, adjust=False).mean()
@@ -75,18 +214,21 @@ class MarketDataAnalyzer:
         df['MACD_signal'] = df['MACD'].ewm(span=9, adjust=False).mean()
         
         # RSI
-        delta = df['close'].diff()
-        gain = (delta.where(delta > 0, 0)).rolling(window=14).mean()
-        loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
-        rs = gain / loss
+        delta = np.diff(close, prepend=close[0])
+        gain = np.where(delta > 0, delta, 0.0)
+        loss = np.where(delta < 0, -delta, 0.0)
+        # Wilder smoothing is an EMA with alpha = 1/period
+        if njit is not None:
+            avg_gain = _wilder(gain, 14)
+            avg_loss = _wilder(loss, 14)
+        else:
+            avg_gain = pd.Series(gain).ewm(alpha=1 / 14, adjust=False).mean().to_numpy()
+            avg_loss = pd.Series(loss).ewm(alpha=1 / 14, adjust=False).mean().to_numpy()
+        # Loss-free windows give rs = inf and RSI = 100; flat windows (0/0) stay NaN
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rs = avg_gain / avg_loss
         df['RSI'] = 100 - (100 / (1 + rs))
         
-        # Bollinger Bands
-        df['BB_middle'] = df['close'].rolling(window=20).mean()
-        bb_std = df['close'].rolling(window=20).std()
-        df['BB_upper'] = df['BB_middle'] + (bb_std * 2)
-        df['BB_lower'] = df['BB_middle'] - (bb_std * 2)
-        
         # Volume indicators
         df['Volume_SMA'] = df['volume'].rolling(window=20).mean()
         df['Volume_ratio'] = df['volume'] / df['Volume_SMA']
@@ -102,69 +244,113 @@ class MarketDataAnalyzer:
         if df.empty or len(df) < 30:  # Need enough data for indicators
             return np.array([])
         
-        # Select latest row with all indicators calculated
-        latest = df.iloc[-1]
-        
-        features = []
-        
-        # Price-based features
-        features.append(latest['close'] / latest['SMA_20'] if latest['SMA_20'] > 0 else 1.0)
-        features.append(latest['close'] / latest['SMA_5'] if latest['SMA_5'] > 0 else 1.0)
-        features.append((latest['close'] - latest['low']) / (latest['high'] - latest['low']) if latest['high'] > latest['low'] else 0.5)
-        
-        # Technical indicators
-        features.append(latest['RSI'] / 100.0 if not pd.isna(latest['RSI']) else 0.5)
-        features.append(latest['MACD'] / latest['close'] if latest['close'] > 0 else 0.0)
-        features.append((latest['close'] - latest['BB_lower']) / (latest['BB_upper'] - latest['BB_lower']) if latest['BB_upper'] > latest['BB_lower'] else 0.5)
-        
-        # Volume features
-        features.append(latest['Volume_ratio'] if not pd.isna(latest['Volume_ratio']) else 1.0)
-        
-        # Momentum features
-        features.append(latest['Price_change'] if not pd.isna(latest['Price_change']) else 0.0)
-        features.append(latest['Price_change_5d'] if not pd.isna(latest['Price_change_5d']) else 0.0)
+        # Select latest row with all indicators calculated, filling gaps in one pass
+        columns = ['close', 'low', 'high', 'SMA_5', 'SMA_20', 'RSI', 'MACD',
+                   'BB_upper', 'BB_lower', 'Volume_ratio', 'Price_change', 'Price_change_5d']
+        defaults = np.array([0.0, 0.0, 0.0, 0.0, 0.0, 50.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0])
+        latest = df[columns].iloc[-1].to_numpy(dtype=np.float64)
+        latest = np.where(np.isnan(latest), defaults, latest)
+        close, low, high, sma_5, sma_20, rsi, macd, bb_upper, bb_lower, volume_ratio, price_change, price_change_5d = latest
+        
+        # Guarded ratios: price vs SMA_20, price vs SMA_5, position in daily range,
+        # MACD vs price, position in Bollinger Bands
+        numerators = np.array([close, close, close - low, macd, close - bb_lower])
+        denominators = np.array([sma_20, sma_5, high - low, close, bb_upper - bb_lower])
+        ratios = np.array([1.0, 1.0, 0.5, 0.0, 0.5])
+        np.divide(numerators, denominators, out=ratios, where=denominators > 0)
         
         # Volatility
         volatility = df['Price_change'].std()
-        features.append(volatility if not pd.isna(volatility) else 0.0)
         
-        return np.array(features)
+        return np.array([
+            ratios[0],
+            ratios[1],
+            ratios[2],
+            rsi / 100.0,
+            ratios[3],
+            ratios[4],
+            volume_ratio,
+            price_change,
+            price_change_5d,
+            volatility if not pd.isna(volatility) else 0.0
+        ])
     
-    def analyze_symbol(self, symbol: str) -> Dict:
+    def analyze_symbol(self, symbol: str, df: pd.DataFrame = None) -> Dict:
         """Analyze a single symbol and generate trading signal"""
-        # Fetch market data
-        df = self.fetch_market_data(symbol)
+        # Fetch market data unless the caller already has it
+        if df is None:
+            df = self.fetch_market_data(symbol)
         
-        if df.empty:
-            return {
-                'symbol': symbol,
-                'action': 'HOLD',
-                'confidence': 0.0,
-                'reason': 'Insufficient data'
-            }
+        return self.analyze_symbols([symbol], {symbol: df})[0]
+    
+    def analyze_symbols(self, symbols: List[str], frames: Dict[str, pd.DataFrame]) -> List[Dict]:
+        """Analyze several symbols, scoring them with the ranker in one batch"""
+        results = [None] * len(symbols)
+        pending = []
         
-        # Calculate indicators
+        for i, symbol in enumerate(symbols):
+            df = frames.get(symbol, pd.DataFrame())
+            
+            if df.empty:
+                results[i] = self._hold_signal(symbol, 'Insufficient data')
+                continue
+            
+            # Reuse the previous signal if no new bar has arrived; rows come back
+            # newest-first, so the latest bar is the index maximum, not the last row
+            key = (symbol, df.index.max(), self.ranker.weights_version)
+            if key in self._sig_cache:
+                results[i] = self._sig_cache[key]
+                continue
+            
+            df, features = self._features_for(df)
+            
+            if features.size == 0:
+                results[i] = self._hold_signal(symbol, 'Insufficient data for analysis')
+                continue
+            
+            pending.append((i, symbol, key, df.iloc[-1], features))
+        
+        # Only score with the ranker once it has trained weights; an untrained network
+        # gives noise. When it does, score all symbols as one (M, F) batch
+        scores = [None] * len(pending)
+        if pending and self.ranker.trained:
+            batch = torch.as_tensor(np.stack([entry[4] for entry in pending]),
+                                    dtype=torch.float32, device=self.ranker.device)
+            # Normalize with the scaler stats the ranker was trained with
+            if self.ranker._mean is not None:
+                batch = self.ranker.preprocess_features(batch)
+            scores = self.ranker.predict_scores(batch)
+        
+        for (i, symbol, key, latest, features), score in zip(pending, scores):
+            result = self._rule_based_signal(symbol, latest, features[-1])
+            if score is not None:
+                result['ranking_score'] = float(score)
+            self._cache_signal(key, result)
+            results[i] = result
+        
+        return results
+    
+    def _hold_signal(self, symbol: str, reason: str) -> Dict:
+        return {
+            'symbol': symbol,
+            'action': 'HOLD',
+            'confidence': 0.0,
+            'reason': reason
+        }
+    
+    def _features_for(self, df: pd.DataFrame) -> Tuple[pd.DataFrame, np.ndarray]:
+        """Calculate indicators and the feature vector for one symbol's data"""
         df = self.calculate_technical_indicators(df)
-        
-        # Prepare features
         features = self.prepare_features(df)
         
-        if features.size == 0:
-            return {
-                'symbol': symbol,
-                'action': 'HOLD',
-                'confidence': 0.0,
-                'reason': 'Insufficient data for analysis'
-            }
-        
-        # Initialize ranker if needed
-        if self.ranker is None:
-            self.ranker = StockRanker(input_features=len(features))
-        
-        # Get prediction (for now, using rule-based logic until we train on real data)
-        latest = df.iloc[-1]
+        if features.size != 0:
+            assert features.size == self.FEATURES, f"Expected {self.FEATURES} features, got {features.size}"
         
-        # Simple trading rules
+        return df, features
+    
+    def _rule_based_signal(self, symbol: str, latest: pd.Series, volatility: float) -> Dict:
+        """Generate a trading signal from the latest indicators"""
+        # Simple trading rules (rule-based until the ranker is trained on real data)
         action = 'HOLD'
         confidence = 0.5
         reasons = []
@@ -232,6 +418,12 @@ class MarketDataAnalyzer:
             }
         }
     
+    def _cache_signal(self, key: Tuple[str, pd.Timestamp, int], result: Dict):
+        self._sig_cache[key] = result
+        self._sig_cache_order.append(key)
+        if len(self._sig_cache_order) > self._sig_cache_size:
+            self._sig_cache.pop(self._sig_cache_order.popleft(), None)
+    
     def calculate_position_size(self, confidence: float, volatility: float) -> float:
         """Calculate suggested position size based on confidence and volatility"""
         base_size = 1000.0  # Base position size in USD
@@ -248,40 +440,62 @@ class MarketDataAnalyzer:
     
     def save_signal(self, signal: Dict):
         """Save trading signal to database"""
-        query = """
-        INSERT INTO trading_signals (symbol, confidence, action, suggested_position_size, timestamp)
-        VALUES (?, ?, ?, ?, ?)
-        """
-        
-        self.cursor.execute(query, (
-            signal['symbol'],
-            signal['confidence'],
-            signal['action'],
-            signal['suggested_position_size'],
-            datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        ))
-        self.conn.commit()
+        self.save_signals_bulk([signal])
+    
+    def save_signals_bulk(self, signals: List[Dict]):
+        """Save several trading signals to database in one transaction"""
+        # Insufficient-data HOLDs carry no position and are not recommendations,
+        # so keep them out of trading_signals (and get_positions)
+        signals = [signal for signal in signals if 'suggested_position_size' in signal]
+        if not signals:
+            return
+        
+        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        rows = [
+            (
+                signal['symbol'],
+                signal['confidence'],
+                signal['action'],
+                signal['suggested_position_size'],
+                timestamp
+            )
+            for signal in signals
+        ]
+        
+        self.cursor.execute("BEGIN IMMEDIATE")
+        try:
+            self.cursor.executemany(self.INSERT_SIGNAL_QUERY, rows)
+            self.cursor.execute("COMMIT")
+        except Exception:
+            # Also covers a failed COMMIT (e.g. SQLITE_BUSY), which would otherwise
+            # leave the transaction open and break every later BEGIN. SQLite rolls
+            # back on its own for errors like SQLITE_FULL, so only roll back if a
+            # transaction is still open, or the original error would be masked
+            if self.conn.in_transaction:
+                self.cursor.execute("ROLLBACK")
+            raise
     
-    def handle_message(self, message: str) -> str:
+    def handle_message(self, message: bytes) -> bytes:
         """Handle incoming messages from C++"""
         try:
-            data = json.loads(message)
+            data = json_loads(message)
             command = data.get('command')
             
             if command == 'analyze':
                 symbol = data.get('symbol', 'BTC')
                 result = self.analyze_symbol(symbol)
                 self.save_signal(result)
-                return json.dumps(result)
+                return json_dumps(result)
                 
             elif command == 'batch_analyze':
                 symbols = data.get('symbols', [])
                 results = []
-                for symbol in symbols:
-                    result = self.analyze_symbol(symbol)
-                    self.save_signal(result)
-                    results.append(result)
-                return json.dumps({'results': results})
+                if symbols:
+                    df = self.fetch_market_data_bulk(symbols)
+                    groups = {sym: group.copy() for sym, group in df.groupby('symbol')} if not df.empty else {}
+                    results = self.analyze_symbols(symbols, groups)
+                    self.save_signals_bulk(results)
+                return json_dumps({'results': results})
                 
             elif command == 'get_positions':
                 # Return current recommended positions
@@ -302,13 +516,13 @@ class MarketDataAnalyzer:
                         'suggested_position_size': row[3],
                         'timestamp': row[4]
                     })
-                return json.dumps({'positions': positions})
+                return json_dumps({'positions': positions})
                 
             else:
-                return json.dumps({'error': 'Unknown command'})
+                return json_dumps({'error': 'Unknown command'})
                 
         except Exception as e:
-            return json.dumps({'error': str(e)})
+            return json_dumps({'error': str(e)})
     
     def run(self):
         """Main loop for the analyzer"""
@@ -326,24 +540,43 @@ class MarketDataAnalyzer:
         
         print("IPC pipes found, opening connections...")
         
-        # Open pipes
-        pipe_in = open(self.pipe_to_python, 'r')
-        pipe_out = open(self.pipe_to_cpp, 'w')
+        # Open pipes; the input side is unbuffered so poll() sees every byte
+        pipe_in = open(self.pipe_to_python, 'rb', buffering=0)
+        pipe_out = open(self.pipe_to_cpp, 'wb')
+        
+        poller = select.poll()
+        poller.register(pipe_in, select.POLLIN)
+        pending = b''
         
         print("Market Data Analyzer ready")
         
         try:
             while self.running:
-                # Read message from C++
-                line = pipe_in.readline().strip()
-                if line:
-                    print(f"Received: {line}")
-                    response = self.handle_message(line)
-                    print(f"Sending: {response}")
-                    pipe_out.write(response + '\n')
-                    pipe_out.flush()
-                else:
+                # Block until C++ writes instead of waking on a timer
+                if not poller.poll(1000):
+                    continue
+                
+                chunk = pipe_in.read(65536)
+                if not chunk:
+                    # Writer closed its end, wait for it to reconnect
                     time.sleep(0.1)
+                    continue
+                
+                # Handle every complete message that arrived in this read
+                pending += chunk
+                *lines, pending = pending.split(b'\n')
+                for raw in lines:
+                    line = raw.strip()
+                    if not line:
+                        continue
+                    # Only decode for logging when asked to; the hot path stays bytes
+                    if self.debug:
+                        print(f"Received: {line.decode(errors='replace')}")
+                    response = self.handle_message(line)
+                    if self.debug:
+                        print(f"Sending: {response.decode()}")
+                    pipe_out.write(response + b'\n')
+                pipe_out.flush()
                     
         except KeyboardInterrupt:
             print("Shutting down...")
@@ -354,5 +587,5 @@ class MarketDataAnalyzer:
             print("Market Data Analyzer stopped")
 
 if __name__ == "__main__":
-    analyzer = MarketDataAnalyzer()
+    analyzer = MarketDataAnalyzer(debug=os.environ.get("TRADING_DEBUG") == "1")
     analyzer.run()
\ No newline at end of file
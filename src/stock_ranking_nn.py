@@ -2,7 +2,6 @@ import numpy as np
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from torch.utils.data import Dataset, DataLoader
 from typing import List, Tuple, Dict
 import pandas as pd
 from sklearn.preprocessing import StandardScaler
@@ -32,52 +31,96 @@ class StockRankingNN(nn.Module):
         return self.network(x)
 
 
-class StockDataset(Dataset):
-    def __init__(self, features: np.ndarray, labels: np.ndarray):
-        self.features = torch.FloatTensor(features)
-        self.labels = torch.FloatTensor(labels)
-    
-    def __len__(self):
-        return len(self.features)
-    
-    def __getitem__(self, idx):
-        return self.features[idx], self.labels[idx]
-
-
 class StockRanker:
-    def __init__(self, input_features: int, hidden_sizes: List[int] = [64, 32, 16]):
+    def __init__(self, input_features: int, hidden_sizes: List[int] = [64, 32, 16],
+                 use_compile: bool = False):
         self.model = StockRankingNN(input_features, hidden_sizes)
         self.scaler = StandardScaler()
+        self._mean = None
+        self._std = None
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         self.model.to(self.device)
+        self.criterion = nn.MarginRankingLoss(margin=1.0)
+        
+        # Optional compiled training forward pass; compilation costs seconds up front
+        # for a few percent at steady state on this MLP, so it is off by default.
+        # self.model stays the plain module so tracing, quantization and the
+        # optimizer all see the same parameters
+        if use_compile and hasattr(torch, 'compile'):
+            self.compiled_model = torch.compile(self.model, dynamic=True)
+        else:
+            self.compiled_model = self.model
+        
+        # Trace the inference graph once (eval mode, so BatchNorm/Dropout are frozen)
+        # and warm it up; the traced module shares parameters with self.model
+        self.model.eval()
+        example = torch.zeros(1, input_features, device=self.device)
+        with torch.no_grad():
+            self.traced = torch.jit.trace(self.model, example)
+            self.traced(example)
+        
+        # Optional int8 copy of the trained model, only built by quantize()
+        self.model_q = None
+        
+        # Scores from randomly initialized weights are meaningless; the version
+        # lets callers that cache scores notice when the weights change
+        self.trained = False
+        self.weights_version = 0
     
-    def preprocess_features(self, stock_data: pd.DataFrame, feature_columns: List[str]) -> np.ndarray:
-        features = stock_data[feature_columns].values
+    def preprocess_features(self, stock_data, feature_columns: List[str] = None):
+        # Tensors already on the device are normalized in place with the cached stats
+        if isinstance(stock_data, torch.Tensor):
+            if self._mean is None:
+                raise ValueError("Scaler must be fit on a DataFrame before normalizing tensors")
+            return stock_data.sub_(self._mean).div_(self._std)
         
-        features = np.nan_to_num(features, nan=0.0)
+        features = stock_data[feature_columns].values.astype(np.float64)
         
-        if hasattr(self.scaler, 'mean_'):
-            features = self.scaler.transform(features)
-        else:
+        features = np.nan_to_num(features, nan=0.0, copy=False)
+        
+        if self._mean is None:
             features = self.scaler.fit_transform(features)
+            self._mean_np = self.scaler.mean_
+            self._std_np = self.scaler.scale_
+            self._mean = torch.tensor(self._mean_np, dtype=torch.float32, device=self.device)
+            self._std = torch.tensor(self._std_np, dtype=torch.float32, device=self.device)
+        else:
+            np.subtract(features, self._mean_np, out=features)
+            np.divide(features, self._std_np, out=features)
         
         return features
     
     def pairwise_ranking_loss(self, scores: torch.Tensor, labels: torch.Tensor, margin: float = 1.0):
-        n = len(scores)
-        losses = []
+        s = scores.view(-1)
+        l = labels.view(-1).to(dtype=s.dtype, device=s.device)
         
-        for i in range(n):
-            for j in range(i + 1, n):
-                if labels[i] > labels[j]:
-                    loss = torch.relu(margin - (scores[i] - scores[j]))
-                elif labels[i] < labels[j]:
-                    loss = torch.relu(margin - (scores[j] - scores[i]))
-                else:
-                    continue
-                losses.append(loss)
+        # Every (i, j) pair at once: sign says which stock should rank higher
+        score_diff = s[:, None] - s[None, :]
+        label_sign = torch.sign(l[:, None] - l[None, :])
+        mask = label_sign != 0
         
-        return torch.mean(torch.stack(losses)) if losses else torch.tensor(0.0)
+        losses = torch.relu(margin - label_sign * score_diff)
+        
+        return (losses * mask).sum() / mask.sum().clamp_min(1)
+    
+    def sampled_ranking_loss(self, scores: torch.Tensor, labels: torch.Tensor, num_pairs: int = None):
+        s = scores.view(-1)
+        l = labels.view(-1).to(dtype=s.dtype, device=s.device)
+        n = len(s)
+        
+        # Sample K random pairs instead of materializing the full n x n matrix
+        if num_pairs is None:
+            num_pairs = 4 * n
+        idx_i = torch.randint(0, n, (num_pairs,), device=s.device)
+        idx_j = torch.randint(0, n, (num_pairs,), device=s.device)
+        
+        target = torch.sign(l[idx_i] - l[idx_j])
+        keep = target != 0
+        
+        if not keep.any():
+            return s.sum() * 0.0
+        
+        return self.criterion(s[idx_i][keep], s[idx_j][keep], target[keep])
     
     def train(self, 
               train_features: np.ndarray, 
@@ -86,33 +129,49 @@ class StockRanker:
               val_labels: np.ndarray = None,
               epochs: int = 100,
               batch_size: int = 32,
-              learning_rate: float = 0.001):
+              learning_rate: float = 0.001,
+              exact_loss: bool = False):
+        
+        # The training table is small, so copy it to the device once and gather
+        # batches there instead of collating and transferring every batch
+        features_all = torch.as_tensor(np.asarray(train_features, dtype=np.float32), device=self.device)
+        labels_all = torch.as_tensor(np.asarray(train_labels, dtype=np.float32), device=self.device)
         
-        train_dataset = StockDataset(train_features, train_labels)
-        train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True)
+        n = len(features_all)
+        num_batches = (n + batch_size - 1) // batch_size
         
         optimizer = optim.Adam(self.model.parameters(), lr=learning_rate)
         
+        # Sampled pairs keep memory linear in batch size; the exact loss scores
+        # every pair and is only practical for small batches
+        loss_fn = self.pairwise_ranking_loss if exact_loss else self.sampled_ranking_loss
+        
+        # Any previous quantized snapshot is stale once the weights change
+        self.model_q = None
+        
         for epoch in range(epochs):
             self.model.train()
             total_loss = 0
             
-            for batch_features, batch_labels in train_loader:
-                batch_features = batch_features.to(self.device)
-                batch_labels = batch_labels.to(self.device)
+            perm = torch.randperm(n, device=self.device)
+            
+            for start in range(0, n, batch_size):
+                batch_idx = perm[start:start + batch_size]
+                batch_features = features_all[batch_idx]
+                batch_labels = labels_all[batch_idx]
                 
                 optimizer.zero_grad()
                 
-                scores = self.model(batch_features).squeeze()
+                scores = self.compiled_model(batch_features).squeeze()
                 
-                loss = self.pairwise_ranking_loss(scores, batch_labels)
+                loss = loss_fn(scores, batch_labels)
                 
                 loss.backward()
                 optimizer.step()
                 
                 total_loss += loss.item()
             
-            avg_loss = total_loss / len(train_loader)
+            avg_loss = total_loss / num_batches
             
             if epoch % 10 == 0:
                 print(f"Epoch {epoch}/{epochs}, Loss: {avg_loss:.4f}")
@@ -120,38 +179,65 @@ class StockRanker:
                 if val_features is not None and val_labels is not None:
                     val_score = self.evaluate(val_features, val_labels)
                     print(f"Validation Ranking Score: {val_score:.4f}")
+        
+        self.trained = True
+        self.weights_version += 1
+    
+    def quantize(self):
+        # Opt-in only: on this small MLP the int8 model is slower than the traced
+        # FP32 graph and shifts scores, so only enable it where it measures faster.
+        # Dynamic quantization is CPU-only.
+        if self.device.type != 'cpu':
+            raise RuntimeError("Dynamic int8 quantization is only supported on CPU")
+        
+        self.model.eval()
+        self.model_q = torch.ao.quantization.quantize_dynamic(self.model, {nn.Linear}, dtype=torch.qint8)
+    
+    def inference_model(self):
+        return self.model_q if self.model_q is not None else self.traced
     
     def evaluate(self, features: np.ndarray, labels: np.ndarray) -> float:
         self.model.eval()
         
-        with torch.no_grad():
+        with torch.inference_mode():
             features_tensor = torch.FloatTensor(features).to(self.device)
-            scores = self.model(features_tensor).cpu().numpy().squeeze()
+            scores = self.inference_model()(features_tensor).cpu().numpy().squeeze()
         
-        predicted_ranks = np.argsort(-scores)
-        true_ranks = np.argsort(-labels)
+        scores = np.atleast_1d(scores)
+        labels = np.asarray(labels).reshape(-1)
         
-        correct = 0
-        total = 0
+        # Compare every pair once via the upper triangle of the outer differences
+        iu = np.triu_indices(len(labels), k=1)
+        diff_labels = np.subtract.outer(labels, labels)[iu]
+        diff_scores = np.subtract.outer(scores, scores)[iu]
         
-        for i in range(len(predicted_ranks)):
-            for j in range(i + 1, len(predicted_ranks)):
-                if labels[predicted_ranks[i]] != labels[predicted_ranks[j]]:
-                    total += 1
-                    if (labels[predicted_ranks[i]] > labels[predicted_ranks[j]]):
-                        correct += 1
+        total = np.count_nonzero(diff_labels)
+        correct = np.count_nonzero((np.sign(diff_labels) == np.sign(diff_scores)) & (diff_labels != 0))
         
         return correct / total if total > 0 else 0.0
     
-    def predict_rankings(self, features: np.ndarray) -> np.ndarray:
+    def predict_scores(self, features: np.ndarray) -> np.ndarray:
         self.model.eval()
         
-        with torch.no_grad():
+        with torch.inference_mode():
+            features_tensor = torch.as_tensor(features, dtype=torch.float32, device=self.device)
+            scores = self.inference_model()(features_tensor).view(-1)
+        
+        return scores.cpu().numpy()
+    
+    def predict_rankings(self, features: np.ndarray, k: int = None) -> Tuple[np.ndarray, np.ndarray]:
+        self.model.eval()
+        
+        if k is None:
+            k = len(features)
+        
+        # Rank on device and only move the top-k indices/scores back to the host
+        with torch.inference_mode():
             features_tensor = torch.FloatTensor(features).to(self.device)
-            scores = self.model(features_tensor).cpu().numpy().squeeze()
+            scores = self.inference_model()(features_tensor).view(-1)
+            top_scores, top_idx = torch.topk(scores, min(k, len(scores)))
         
-        rankings = np.argsort(-scores)
-        return rankings, scores
+        return top_idx.cpu().numpy(), top_scores.cpu().numpy()
 
 
 def create_mock_stock_data(n_stocks: int = 100, n_features: int = 10) -> Tuple[pd.DataFrame, np.ndarray]:
@@ -205,4 +291,4 @@ if __name__ == "__main__":
     print("\nTop 10 ranked stocks:")
     for i in range(min(10, len(rankings))):
         stock_idx = rankings[i]
-        print(f"{i+1}. {val_data.iloc[stock_idx]['ticker']} - Score: {scores[stock_idx]:.4f}")
\ No newline at end of file
+        print(f"{i+1}. {val_data.iloc[stock_idx]['ticker']} - Score: {scores[i]:.4f}")
\ No newline at end of file
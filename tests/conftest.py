@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+
+# The analyzer imports its siblings by module name, as it does when run from src/
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+
+@pytest.fixture
+def analyzer(tmp_path):
+    from market_data_analyzer import MarketDataAnalyzer
+    
+    return MarketDataAnalyzer(db_path=str(tmp_path / "trading_system.db"),
+                              pipe_base=str(tmp_path / "pipe"))
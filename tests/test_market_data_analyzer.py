@@ -0,0 +1,230 @@
+import json
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import market_data_analyzer
+
+
+def make_market_data(n: int = 40, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    close = 100 + np.cumsum(rng.normal(0, 1, n))
+    index = pd.date_range("2026-01-01", periods=n, freq="h", name="timestamp")
+    return pd.DataFrame({
+        'symbol': 'A',
+        'open': close,
+        'high': close + 1,
+        'low': close - 1,
+        'close': close,
+        'volume': rng.uniform(1000, 2000, n),
+    }, index=index)
+
+
+def test_fallback_bollinger_matches_pandas_rolling(analyzer, monkeypatch):
+    monkeypatch.setattr(market_data_analyzer, 'talib', None)
+    df = analyzer.calculate_technical_indicators(make_market_data())
+    
+    expected_middle = df['close'].rolling(window=20).mean()
+    expected_std = df['close'].rolling(window=20).std()
+    
+    np.testing.assert_allclose(df['BB_middle'], expected_middle)
+    np.testing.assert_allclose(df['BB_upper'], expected_middle + 2 * expected_std)
+    np.testing.assert_allclose(df['BB_lower'], expected_middle - 2 * expected_std)
+
+
+def test_talib_and_fallback_indicators_agree(analyzer, monkeypatch):
+    pytest.importorskip('talib')
+    columns = ['SMA_5', 'SMA_20', 'EMA_12', 'EMA_26', 'MACD', 'MACD_signal',
+               'RSI', 'BB_middle', 'BB_upper', 'BB_lower']
+    
+    with_talib = analyzer.calculate_technical_indicators(make_market_data())
+    monkeypatch.setattr(market_data_analyzer, 'talib', None)
+    without_talib = analyzer.calculate_technical_indicators(make_market_data())
+    
+    for column in columns:
+        np.testing.assert_allclose(with_talib[column], without_talib[column], rtol=1e-7, err_msg=column)
+
+
+def test_rsi_is_100_on_loss_free_series(analyzer):
+    df = make_market_data()
+    df['close'] = np.linspace(100, 140, len(df))
+    df = analyzer.calculate_technical_indicators(df)
+    
+    assert df['RSI'].iloc[-1] == pytest.approx(100.0)
+
+
+def test_rsi_is_nan_on_flat_series(analyzer):
+    df = make_market_data()
+    df['close'] = 100.0
+    df = analyzer.calculate_technical_indicators(df)
+    
+    assert np.isnan(df['RSI'].iloc[-1])
+
+
+def test_signal_cache_hits_until_a_new_bar_arrives(analyzer):
+    # Same newest-first order the fetch queries return
+    df = make_market_data().sort_index(ascending=False)
+    
+    first = analyzer.analyze_symbol('A', df.copy())
+    assert analyzer.analyze_symbol('A', df.copy()) is first
+    
+    new_bar = df.iloc[[0]].copy()
+    new_bar.index = new_bar.index + pd.Timedelta(hours=1)
+    new_bar[['open', 'high', 'low', 'close']] = [50.0, 51.0, 49.0, 50.0]
+    newer = pd.concat([new_bar, df])
+    
+    assert analyzer.analyze_symbol('A', newer) is not first
+
+
+def create_signals_table(analyzer):
+    analyzer.connect_database()
+    analyzer.cursor.execute("""
+    CREATE TABLE trading_signals (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        symbol TEXT NOT NULL,
+        confidence REAL NOT NULL,
+        action TEXT NOT NULL,
+        suggested_position_size REAL NOT NULL,
+        timestamp DATETIME NOT NULL
+    )
+    """)
+
+
+def test_save_signals_bulk_skips_insufficient_data_holds(analyzer):
+    create_signals_table(analyzer)
+    
+    analyzer.save_signals_bulk([
+        {'symbol': 'A', 'action': 'BUY', 'confidence': 0.7, 'suggested_position_size': 700.0},
+        {'symbol': 'ZZZ', 'action': 'HOLD', 'confidence': 0.0, 'reason': 'Insufficient data'},
+    ])
+    
+    rows = analyzer.cursor.execute("SELECT symbol FROM trading_signals").fetchall()
+    assert rows == [('A',)]
+
+
+def test_save_signals_bulk_rolls_back_on_failure(analyzer):
+    create_signals_table(analyzer)
+    
+    with pytest.raises(Exception):
+        analyzer.save_signals_bulk([
+            {'symbol': 'A', 'action': 'BUY', 'confidence': 0.7, 'suggested_position_size': 700.0},
+            {'symbol': None, 'action': 'BUY', 'confidence': 0.7, 'suggested_position_size': 700.0},
+        ])
+    
+    assert not analyzer.conn.in_transaction
+    assert analyzer.cursor.execute("SELECT COUNT(*) FROM trading_signals").fetchone() == (0,)
+
+
+def test_untrained_ranker_adds_no_ranking_score(analyzer):
+    result = analyzer.analyze_symbol('A', make_market_data())
+    
+    assert result['action'] in ('BUY', 'SELL', 'HOLD')
+    assert 'ranking_score' not in result
+
+
+def test_json_fallback_writes_nan_as_null(monkeypatch):
+    monkeypatch.setattr(market_data_analyzer, 'orjson', None)
+    payload = {'rsi': float('nan'), 'values': [1.5, float('inf')]}
+    
+    assert market_data_analyzer.json_dumps(payload) == b'{"rsi": null, "values": [1.5, null]}'
+
+
+def train_tiny_ranker(ranker):
+    rng = np.random.default_rng(1)
+    columns = [f"feature_{i}" for i in range(10)]
+    data = pd.DataFrame(rng.normal(size=(16, 10)), columns=columns)
+    features = ranker.preprocess_features(data, columns)
+    ranker.train(features, rng.uniform(size=16), epochs=1, batch_size=8)
+
+
+def test_trained_ranker_scores_normalized_features(analyzer):
+    before = analyzer.analyze_symbol('A', make_market_data())
+    assert 'ranking_score' not in before
+    
+    train_tiny_ranker(analyzer.ranker)
+    
+    # Same bar as before; retraining must not serve the cached unscored signal
+    result = analyzer.analyze_symbol('A', make_market_data())
+    
+    features = analyzer.prepare_features(analyzer.calculate_technical_indicators(make_market_data()))
+    normalized = (features - analyzer.ranker._mean_np) / analyzer.ranker._std_np
+    expected = analyzer.ranker.predict_scores(normalized[None, :])[0]
+    
+    assert result['ranking_score'] == pytest.approx(float(expected), rel=1e-5)
+
+
+def seed_market_data(analyzer, symbols=('A', 'B'), n=40):
+    create_signals_table(analyzer)
+    analyzer.cursor.execute("""
+    CREATE TABLE market_data (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        symbol TEXT NOT NULL,
+        open REAL NOT NULL,
+        high REAL NOT NULL,
+        low REAL NOT NULL,
+        close REAL NOT NULL,
+        volume REAL NOT NULL,
+        timestamp DATETIME NOT NULL
+    )
+    """)
+    
+    # Hourly bars ending two days ago, inside the 30-day fetch window, written in
+    # the same '%Y-%m-%d %H:%M:%S' format the C++ side uses
+    end = (datetime.now() - timedelta(days=2)).replace(minute=0, second=0, microsecond=0)
+    rows = []
+    for seed, symbol in enumerate(symbols):
+        df = make_market_data(n, seed=seed)
+        for i, bar in enumerate(df.itertuples()):
+            timestamp = (end - timedelta(hours=n - 1 - i)).strftime('%Y-%m-%d %H:%M:%S')
+            rows.append((symbol, bar.open, bar.high, bar.low, bar.close, bar.volume, timestamp))
+    analyzer.cursor.executemany("""
+    INSERT INTO market_data (symbol, open, high, low, close, volume, timestamp)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, rows)
+
+
+def test_batch_analyze_matches_per_symbol_analyze(analyzer):
+    seed_market_data(analyzer)
+    symbols = ['A', 'B', 'MISSING']
+    
+    batch = json.loads(analyzer.handle_message(
+        json.dumps({'command': 'batch_analyze', 'symbols': symbols}).encode()))
+    
+    analyzer._sig_cache.clear()
+    analyzer._sig_cache_order.clear()
+    single = [
+        json.loads(analyzer.handle_message(json.dumps({'command': 'analyze', 'symbol': symbol}).encode()))
+        for symbol in symbols
+    ]
+    
+    assert 'error' not in batch
+    assert batch['results'] == single
+    assert batch['results'][2]['reason'] == 'Insufficient data'
+
+
+def test_bulk_fetch_groups_match_single_symbol_fetch(analyzer):
+    seed_market_data(analyzer)
+    
+    bulk = analyzer.fetch_market_data_bulk(['A', 'B', 'MISSING'])
+    groups = dict(tuple(bulk.groupby('symbol')))
+    
+    assert set(groups) == {'A', 'B'}
+    for symbol in ('A', 'B'):
+        pd.testing.assert_frame_equal(groups[symbol], analyzer.fetch_market_data(symbol))
+
+
+def test_market_data_frame_matches_read_sql_query(analyzer):
+    seed_market_data(analyzer)
+    
+    expected = pd.read_sql_query("""
+    SELECT symbol, open, high, low, close, volume, timestamp
+    FROM market_data
+    WHERE symbol = ?
+    ORDER BY timestamp DESC
+    """, analyzer.conn, params=('A',))
+    expected['timestamp'] = pd.to_datetime(expected['timestamp'])
+    expected.set_index('timestamp', inplace=True)
+    
+    pd.testing.assert_frame_equal(analyzer.fetch_market_data('A'), expected)
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+import torch
+
+from stock_ranking_nn import StockRanker
+
+
+@pytest.fixture
+def ranker():
+    torch.manual_seed(0)
+    return StockRanker(input_features=4, hidden_sizes=[32])
+
+
+def reference_pairwise_loss(scores, labels, margin=1.0):
+    losses = []
+    for i in range(len(scores)):
+        for j in range(i + 1, len(scores)):
+            if labels[i] > labels[j]:
+                losses.append(max(0.0, margin - (scores[i] - scores[j])))
+            elif labels[i] < labels[j]:
+                losses.append(max(0.0, margin - (scores[j] - scores[i])))
+    return np.mean(losses) if losses else 0.0
+
+
+def test_pairwise_ranking_loss_matches_reference_loop(ranker):
+    rng = np.random.default_rng(0)
+    scores = rng.normal(size=12)
+    # Include ties, which must be ignored
+    labels = rng.integers(0, 4, size=12).astype(np.float64)
+    
+    loss = ranker.pairwise_ranking_loss(torch.tensor(scores), torch.tensor(labels))
+    
+    assert loss.item() == pytest.approx(reference_pairwise_loss(scores, labels))
+
+
+def test_pairwise_ranking_loss_is_zero_when_all_labels_tie(ranker):
+    loss = ranker.pairwise_ranking_loss(torch.randn(5), torch.ones(5))
+    
+    assert loss.item() == 0.0
+
+
+def reference_ranking_accuracy(scores, labels):
+    predicted_ranks = np.argsort(-scores)
+    correct = 0
+    total = 0
+    for i in range(len(predicted_ranks)):
+        for j in range(i + 1, len(predicted_ranks)):
+            if labels[predicted_ranks[i]] != labels[predicted_ranks[j]]:
+                total += 1
+                if labels[predicted_ranks[i]] > labels[predicted_ranks[j]]:
+                    correct += 1
+    return correct / total if total > 0 else 0.0
+
+
+def test_evaluate_matches_reference_loop(ranker):
+    rng = np.random.default_rng(1)
+    features = rng.normal(size=(30, 4)).astype(np.float32)
+    labels = rng.integers(0, 5, size=30).astype(np.float64)
+    
+    scores = ranker.predict_scores(features)
+    
+    assert ranker.evaluate(features, labels) == pytest.approx(reference_ranking_accuracy(scores, labels))
+
+
+def test_predict_rankings_returns_top_k_in_ranked_order(ranker):
+    rng = np.random.default_rng(2)
+    features = rng.normal(size=(20, 4)).astype(np.float32)
+    
+    all_scores = ranker.predict_scores(features)
+    rankings, scores = ranker.predict_rankings(features, k=5)
+    
+    expected = np.argsort(-all_scores)[:5]
+    np.testing.assert_array_equal(rankings, expected)
+    # Scores are returned in ranked order, aligned with rankings, not input order
+    np.testing.assert_allclose(scores, all_scores[expected], rtol=1e-6)
+
+
+def test_predict_rankings_defaults_to_all_rows(ranker):
+    features = np.random.default_rng(3).normal(size=(7, 4)).astype(np.float32)
+    
+    rankings, scores = ranker.predict_rankings(features)
+    
+    assert sorted(rankings.tolist()) == list(range(7))
+    assert np.all(np.diff(scores) <= 0)